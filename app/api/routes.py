@@ -1,17 +1,28 @@
 import os
+import uuid
+import asyncio
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from typing import Annotated, List
+from typing import Annotated, Any, Dict, List, Literal, Optional, Set, Union
 from pathlib import Path
 
+try:
+    # Serializzazione veloce se orjson è installato
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+    import orjson  # noqa: F401
+except ImportError:
+    from fastapi.responses import JSONResponse as FastJSONResponse
+
 # Importiamo il nostro nuovo modello di risposta
 from app.models.documents import AnalyzedClause
 from app.core import processor
 from app.models.documents import (
     AnalyzedClause,
     ChatRequest,
+    ClauseSummary,
     ChatResponse,
 )  # Aggiorna l'import
 from app.core import processor, llm_service  # Aggiorna l'import
+from app.config import ANALYSIS_DEADLINE_SECONDS
 
 router = APIRouter()
 
@@ -25,18 +36,110 @@ async def handle_chat(request: ChatRequest):
     return ChatResponse(answer=answer)
 
 
-@router.post("/analyze", response_model=List[AnalyzedClause])
-@router.post("/analyze", response_model=List[AnalyzedClause])
+@router.get("/llm/stats")
+async def llm_stats():
+    """
+    Statistiche dello scheduler LLM: code, chiamate in corso e tempi di attesa.
+    """
+    return llm_service.scheduler.get_stats()
+
+
+# Modello che descrive ogni vista di /analyze
+VIEW_MODELS = {"full": AnalyzedClause, "summary": ClauseSummary}
+
+
+def _parse_fields(view: str, fields: Optional[str]) -> Optional[Set[str]]:
+    """
+    Converte `fields` (nomi separati da virgola) in un insieme, verificando
+    che ogni nome esista nella vista richiesta.
+    """
+    if not fields:
+        return None
+    selected = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = selected - set(VIEW_MODELS[view].model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"Campi non validi per la vista '{view}': "
+                f"{', '.join(sorted(unknown))}"
+            ),
+        )
+    return selected
+
+
+def _project_results(
+    results: List[Dict[str, Any]], view: str, selected: Optional[Set[str]]
+) -> List[Dict[str, Any]]:
+    """
+    Riduce i risultati dell'analisi alla vista/campi richiesti.
+    - view="full": risultato completo (default, invariato);
+    - view="summary": solo ID, stato e raccomandazione, con i precedenti
+      citati per ID invece che per esteso (vedi ClauseSummary);
+    - selected: campi da mantenere (già validati da _parse_fields).
+    """
+    if view == "summary":
+        results = [
+            {
+                "clause_id": r["clause_id"],
+                "parent_id": r.get("parent_id"),
+                "status": r["status"],
+                "recommendation": (r.get("llm_analysis") or {}).get(
+                    "recommendation"
+                ),
+                "historical_precedent_ids": [
+                    p["historical_id"] for p in r.get("historical_precedents", [])
+                ],
+            }
+            for r in results
+        ]
+    if selected:
+        results = [{k: v for k, v in r.items() if k in selected} for r in results]
+    return results
+
+
+@router.post(
+    "/analyze",
+    response_model=None,
+    responses={
+        200: {
+            "model": Union[List[AnalyzedClause], List[ClauseSummary]],
+            "description": (
+                "Lista di AnalyzedClause (view=full) o di ClauseSummary "
+                "(view=summary); con `fields` ogni elemento contiene solo "
+                "i campi richiesti."
+            ),
+        }
+    },
+)
 async def analyze_document(
     standard_id: Annotated[str, Form()],
     company_document: Annotated[UploadFile, File()],
+    view: Annotated[Literal["full", "summary"], Form()] = "full",
+    fields: Annotated[Optional[str], Form()] = None,
+    analysis_id: Annotated[Optional[str], Form()] = None,
 ):
+    """
+    Confronta il documento aziendale con lo standard indicato.
+    `view` e `fields` permettono di ridurre la risposta (vedi _project_results).
+    `analysis_id` (ID dell'analisi o del tenant) identifica la coda nello
+    scheduler LLM e in /llm/stats; se assente ne viene generato uno,
+    restituito nell'header X-Analysis-Id.
+    """
+    selected_fields = _parse_fields(view, fields)
+
     # 1. Controllo estensione
     if not company_document.filename.lower().endswith((".docx", ".pdf")):
         raise HTTPException(
             status_code=400, detail="Formato file non supportato. Usare .docx o .pdf"
         )
 
+    queue = analysis_id or f"analysis-{uuid.uuid4().hex[:8]}"
+    print(f"Coda LLM per l'analisi: {queue}")
+
+    # Budget di tempo complessivo per l'analisi (parsing + chiamate LLM)
+    deadline = asyncio.get_running_loop().time() + ANALYSIS_DEADLINE_SECONDS
+
     try:
         # —––– DEBUG: leggi e poi stampa
         company_content = await company_document.read()
@@ -44,10 +147,9 @@ async def analyze_document(
         print(f"Dimensione contenuto: {len(company_content)} bytes")
 
         # 2. Estrai testo dal file
-        company_raw_text = processor.parse_document_content(
-            company_document.filename, company_content
-        )
-        company_clauses = processor.segment_text_into_clauses(company_raw_text)
+        company_clauses = processor.build_clause_tree_from_pages(
+            processor.iter_document_pages(company_document.filename, company_content)
+        ).nodes
 
         # 3. Trova lo standard: prova .docx poi .pdf
         std_path: Optional[Path] = None
@@ -68,10 +170,9 @@ async def analyze_document(
 
         # 4. Leggi e processa lo standard
         standard_content = std_path.read_bytes()
-        standard_raw_text = processor.parse_document_content(
-            std_path.name, standard_content
-        )
-        standard_clauses = processor.segment_text_into_clauses(standard_raw_text)
+        standard_clauses = processor.build_clause_tree_from_pages(
+            processor.iter_document_pages(std_path.name, standard_content)
+        ).nodes
 
         print(
             f"Clausole azienda: {len(company_clauses)}, "
@@ -80,9 +181,17 @@ async def analyze_document(
 
         # 5. Confronta e genera risultati
         analysis_results = await processor.compare_clauses(
-            company_clauses, standard_clauses
+            company_clauses,
+            standard_clauses,
+            deadline=deadline,
+            queue=queue,
+        )
+        # I risultati sono costruiti da noi: restituendo direttamente una
+        # Response si evita la ri-validazione contro response_model.
+        return FastJSONResponse(
+            _project_results(analysis_results, view, selected_fields),
+            headers={"X-Analysis-Id": queue},
         )
-        return analysis_results
 
     except HTTPException:
         # rilancialo (404 per standard mancante, 400 per estensione)
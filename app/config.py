@@ -8,6 +8,16 @@ HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_MODEL = "mistralai/mistral-small-3.2-24b-instruct:free"  # puoi cambiarlo con un altro modello gratuito
+# Modello più veloce/economico usato quando il budget di tempo sta per esaurirsi
+OPENROUTER_FALLBACK_MODEL = os.getenv(
+    "OPENROUTER_FALLBACK_MODEL", "meta-llama/llama-3.2-3b-instruct:free"
+)
+# Budget di tempo (secondi) per l'intera analisi di un documento
+ANALYSIS_DEADLINE_SECONDS = float(os.getenv("ANALYSIS_DEADLINE_SECONDS", "90"))
+# Numero massimo di chiamate LLM contemporanee verso OpenRouter (tutte le richieste)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Numero massimo di chiamate di embedding (Hugging Face) contemporanee
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
 
 if not HUGGINGFACE_API_KEY:
     raise RuntimeError("❌ La variabile HUGGINGFACE_API_KEY non è definita!")
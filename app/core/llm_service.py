@@ -2,9 +2,15 @@
 
 import os
 import json
-from typing import Dict, Any, List
+import asyncio
+import heapq
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Any, List, Optional, Tuple
 import re  # ← aggiungi questa riga
 import httpx
+from app.config import LLM_MAX_CONCURRENCY, OPENROUTER_FALLBACK_MODEL
 from app.models.documents import ChatRequest
 
 # -------------------------------------------------------------------
@@ -90,18 +96,19 @@ def _format_precedents_for_prompt(precedents: List[Dict[str, Any]]) -> str:
 # -------------------------------------------------------------------
 # FUNZIONE COMUNE PER CHIAMARE OPENROUTER
 # -------------------------------------------------------------------
-# -------------------------------------------------------------------
-# FUNZIONE COMUNE PER CHIAMARE OPENROUTER (versione migliorata)
-# -------------------------------------------------------------------
-async def _call_openrouter(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+async def _call_openrouter(
+    messages: List[Dict[str, Any]],
+    model: str = OPENROUTER_MODEL,
+    timeout: float = 60.0,
+) -> Dict[str, Any]:
     payload = {
-        "model": OPENROUTER_MODEL,
+        "model": model,
         "messages": messages,
         "temperature": 0.7,
         "max_tokens": 1024,
     }
     print("DEBUG openrouter request:", payload)  # log payload
-    async with httpx.AsyncClient(timeout=60.0) as client:
+    async with httpx.AsyncClient(timeout=timeout) as client:
         resp = await client.post(
             url=OPENROUTER_URL,
             headers={
@@ -119,22 +126,265 @@ async def _call_openrouter(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
         resp.raise_for_status()
         return resp.json()
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(
-            url=OPENROUTER_URL,
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "Referer": "https://tuosito.com",  # Header corretto
-                "X-Title": "istruttoria-cdp",  # Opzionale per leaderboard
-            },
-            json={
-                "model": OPENROUTER_MODEL,
-                "messages": messages,
-            },
+
+# -------------------------------------------------------------------
+# SCHEDULER CENTRALE (fair queueing + priorità)
+# -------------------------------------------------------------------
+PRIORITY_INTERACTIVE = 0  # /chat
+PRIORITY_BULK = 1  # analisi delle clausole
+
+
+class LLMScheduler:
+    """
+    Coda unica per tutte le chiamate LLM del processo.
+    - Limite globale di chiamate contemporanee.
+    - Il traffico interattivo passa sempre prima di quello bulk.
+    - All'interno della stessa priorità le code (una per analisi) sono
+      servite con fair queueing: ogni job riceve un tag virtuale
+      di fine, quindi un contratto da 300 clausole non affama un
+      emendamento da 5.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self._running = 0
+        self._heap: List[Tuple[int, float, int, str, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._queued: Dict[str, int] = {}
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def has_capacity(self) -> bool:
+        return self._running < self.max_concurrency and not self._heap
+
+    @asynccontextmanager
+    async def slot(
+        self, queue: str, priority: int = PRIORITY_BULK
+    ) -> AsyncIterator[None]:
+        loop = asyncio.get_running_loop()
+        enqueued_at = loop.time()
+        if self.has_capacity():
+            self._running += 1
+        else:
+            start = max(self._virtual_time, self._last_finish.get(queue, 0.0))
+            finish = start + 1.0
+            self._last_finish[queue] = finish
+            future = loop.create_future()
+            heapq.heappush(
+                self._heap, (priority, finish, next(self._seq), queue, future)
+            )
+            self._queued[queue] = self._queued.get(queue, 0) + 1
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Slot già assegnato ma mai usato: lo passiamo al prossimo
+                    self._release()
+                else:
+                    future.cancel()
+                    self._dequeued(queue)
+                raise
+
+        waited = loop.time() - enqueued_at
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        try:
+            yield
+        finally:
+            self._completed += 1
+            self._release()
+
+    def _dequeued(self, queue: str) -> None:
+        remaining = self._queued.get(queue, 0) - 1
+        if remaining > 0:
+            self._queued[queue] = remaining
+        else:
+            self._queued.pop(queue, None)
+            # Le voci annullate restano nell'heap fino al pop: non contano
+            if not any(
+                entry[3] == queue and not entry[4].cancelled() for entry in self._heap
+            ):
+                self._last_finish.pop(queue, None)
+
+    def _release(self) -> None:
+        self._running -= 1
+        while self._heap and self._running < self.max_concurrency:
+            _, finish, _, queue, future = heapq.heappop(self._heap)
+            if future.cancelled():
+                continue
+            self._virtual_time = max(self._virtual_time, finish)
+            self._dequeued(queue)
+            self._running += 1
+            future.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        started = self._completed + self._running
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "queued_interactive": sum(
+                1
+                for p, *_, f in self._heap
+                if p == PRIORITY_INTERACTIVE and not f.cancelled()
+            ),
+            "queued_bulk": sum(
+                1 for p, *_, f in self._heap if p == PRIORITY_BULK and not f.cancelled()
+            ),
+            "queue_depths": dict(self._queued),
+            "completed": self._completed,
+            "avg_wait_seconds": self._total_wait / started if started else 0.0,
+            "max_wait_seconds": self._max_wait,
+        }
+
+
+scheduler = LLMScheduler(LLM_MAX_CONCURRENCY)
+
+
+# -------------------------------------------------------------------
+# SCHEDULING CON DEADLINE (hedging + fallback)
+# -------------------------------------------------------------------
+# Ritardo di hedging usato finché non ci sono abbastanza campioni di latenza
+HEDGE_DEFAULT_DELAY = 15.0
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+_latencies: Dict[str, Deque[float]] = {}
+
+
+class DeadlineExceeded(Exception):
+    """Il budget di tempo dell'analisi è esaurito prima della risposta."""
+
+
+def _record_latency(model: str, seconds: float) -> None:
+    _latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def _p95_latency(model: str) -> Optional[float]:
+    samples = _latencies.get(model)
+    if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+def _pick_model(remaining: float) -> str:
+    """Passa al modello di fallback se il budget non copre il p95 del principale."""
+    p95 = _p95_latency(OPENROUTER_MODEL)
+    if p95 is not None and remaining < p95 and OPENROUTER_FALLBACK_MODEL:
+        return OPENROUTER_FALLBACK_MODEL
+    return OPENROUTER_MODEL
+
+
+async def _timed_call(
+    messages: List[Dict[str, Any]],
+    model: str,
+    timeout: float,
+    queue: str,
+    slot_granted: Optional[asyncio.Event] = None,
+):
+    async with scheduler.slot(queue):
+        if slot_granted is not None:
+            slot_granted.set()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        completed = False
+        try:
+            data = await _call_openrouter(messages, model=model, timeout=timeout)
+            completed = True
+            return data
+        finally:
+            elapsed = loop.time() - started
+            # Le chiamate annullate (hedge perso, deadline) o fallite contano
+            # come limite inferiore solo se già più lente del p95 corrente:
+            # altrimenti il p95 verrebbe sottostimato.
+            threshold = _p95_latency(model) or HEDGE_DEFAULT_DELAY
+            if completed or elapsed >= threshold:
+                _record_latency(model, elapsed)
+
+
+async def _call_with_deadline(
+    messages: List[Dict[str, Any]], deadline: Optional[float], queue: str
+) -> Dict[str, Any]:
+    """
+    Chiama OpenRouter rispettando una deadline assoluta (loop.time()).
+    - Se il budget residuo è inferiore al p95 del modello principale,
+      usa direttamente il modello di fallback.
+    - Se la chiamata supera il p95, lancia una richiesta duplicata (hedge)
+      e tiene la prima che risponde. Il tempo di attesa nello scheduler
+      non conta: il timer parte quando la chiamata ottiene lo slot.
+    - Allo scadere della deadline annulla tutto e solleva DeadlineExceeded.
+    """
+    if deadline is None:
+        async with scheduler.slot(queue):
+            return await _call_openrouter(messages)
+
+    loop = asyncio.get_running_loop()
+    remaining = deadline - loop.time()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+
+    model = _pick_model(remaining)
+    hedge_delay = _p95_latency(model) or HEDGE_DEFAULT_DELAY
+
+    slot_granted = asyncio.Event()
+    pending = {
+        asyncio.create_task(
+            _timed_call(messages, model, remaining, queue, slot_granted)
         )
-        resp.raise_for_status()
-        return resp.json()
+    }
+    hedged = False
+    last_error: Optional[BaseException] = None
+    try:
+        # Attende che la chiamata parta davvero (o termini) prima di
+        # avviare il timer di hedging
+        granted = asyncio.create_task(slot_granted.wait())
+        try:
+            await asyncio.wait(
+                pending | {granted},
+                timeout=remaining,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            granted.cancel()
+
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise DeadlineExceeded()
+            wait_for = remaining if hedged else min(hedge_delay, remaining)
+            done, pending = await asyncio.wait(
+                pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+
+            if not hedged and (
+                not pending or (not done and scheduler.has_capacity())
+            ):
+                # Chiamata lenta o fallita: duplica la richiesta, sul modello
+                # di fallback se il budget residuo non copre un'altra chiamata.
+                # Se lo scheduler è saturo la chiamata lenta non viene
+                # duplicata, per non allungare le code delle altre analisi.
+                hedged = True
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise DeadlineExceeded()
+                pending.add(
+                    asyncio.create_task(
+                        _timed_call(
+                            messages, _pick_model(remaining), remaining, queue
+                        )
+                    )
+                )
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
 
 
 # -------------------------------------------------------------------
@@ -149,9 +399,11 @@ async def generate_chat_response(request: ChatRequest) -> str:
     )
 
     try:
-        data = await _call_openrouter(
-            [{"role": "system", "content": ""}, {"role": "user", "content": prompt}]
-        )
+        # La chat ha priorità sulle analisi bulk
+        async with scheduler.slot("chat", priority=PRIORITY_INTERACTIVE):
+            data = await _call_openrouter(
+                [{"role": "system", "content": ""}, {"role": "user", "content": prompt}]
+            )
         return data["choices"][0]["message"]["content"]
     except Exception as e:
         print("ERROR generate_chat_response:", e)
@@ -181,7 +433,11 @@ def parse_json_output(output_str: str):
 # dentro app/core/llm_service.py, sostituisci generate_clause_analysis con:
 
 
-async def generate_clause_analysis(clause_data: Dict[str, Any]) -> Dict[str, Any]:
+async def generate_clause_analysis(
+    clause_data: Dict[str, Any],
+    deadline: Optional[float] = None,
+    queue: str = "default",
+) -> Dict[str, Any]:
     # Salta le clausole non modificate o senza testo proposto dall'azienda
     if clause_data.get("status") not in ["modified", "new"] or not clause_data.get(
         "company_text"
@@ -202,11 +458,13 @@ async def generate_clause_analysis(clause_data: Dict[str, Any]) -> Dict[str, Any
 
     try:
         # Chiamata al modello via OpenRouter
-        data = await _call_openrouter(
+        data = await _call_with_deadline(
             [
                 {"role": "system", "content": ""},
                 {"role": "user", "content": full_prompt},
-            ]
+            ],
+            deadline,
+            queue,
         )
         output_str = data["choices"][0]["message"]["content"]
         print("DEBUG generate_clause_analysis output_str:", output_str)
@@ -225,6 +483,14 @@ async def generate_clause_analysis(clause_data: Dict[str, Any]) -> Dict[str, Any
 
         return result
 
+    except DeadlineExceeded:
+        print(f"WARNING: deadline superata per la clausola {clause_data['clause_id']}")
+        return {
+            "summary": "Analisi non completata entro il tempo disponibile.",
+            "risk_assessment": "N/D",
+            "recommendation": "PENDING",
+            "suggested_counter_proposal": "",
+        }
     except Exception as e:
         print(f"ERROR generate_clause_analysis: {e}")
         return {
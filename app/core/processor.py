@@ -1,86 +1,277 @@
 import io
 import re
-from app.config import HUGGINGFACE_API_KEY
-from typing import List, IO
+from dataclasses import dataclass, field
+from app.config import EMBEDDING_MAX_CONCURRENCY, HUGGINGFACE_API_KEY
+from typing import Any, Dict, Iterable, List, IO, Optional, Sequence, Tuple
 from docx import Document as DocxDocument
 from pypdf import PdfReader
-from app.models.documents import Clause
 from app.core import vector_store
 import asyncio  # Aggiungi questo import
 from app.core import vector_store, llm_service  # Aggiungi llm_service
 
 
-def _extract_text_from_docx(file_stream: IO[bytes]) -> str:
-    """Estrae il testo da un file DOCX."""
+def _iter_docx_paragraphs(file_stream: IO[bytes]) -> Iterable[str]:
+    """Estrae il testo da un file DOCX, paragrafo per paragrafo."""
     document = DocxDocument(file_stream)
-    full_text = [para.text for para in document.paragraphs]
-    return "\n".join(full_text)
+    for para in document.paragraphs:
+        yield para.text
 
 
-def _extract_text_from_pdf(file_stream: IO[bytes]) -> str:
-    """Estrae il testo da un file PDF."""
+def _iter_pdf_pages(file_stream: IO[bytes]) -> Iterable[str]:
+    """Estrae il testo da un file PDF, pagina per pagina."""
     reader = PdfReader(file_stream)
-    full_text = [page.extract_text() for page in reader.pages if page.extract_text()]
-    return "\n".join(full_text)
+    for page in reader.pages:
+        page_text = page.extract_text()
+        if page_text:
+            yield page_text
 
 
-def parse_document_content(filename: str, content: bytes) -> str:
+def iter_document_pages(filename: str, content: bytes) -> Iterable[str]:
     """
-    Funzione di alto livello per orchestrare l'estrazione del testo
-    in base all'estensione del file.
+    Restituisce il testo del documento come stream di pagine (PDF) o
+    paragrafi (DOCX), in base all'estensione del file.
     """
     file_stream = io.BytesIO(content)
     if filename.endswith(".docx"):
-        return _extract_text_from_docx(file_stream)
+        return _iter_docx_paragraphs(file_stream)
     elif filename.endswith(".pdf"):
-        return _extract_text_from_pdf(file_stream)
+        return _iter_pdf_pages(file_stream)
     else:
         # Questo caso è già gestito a livello di API, ma è buona norma averlo.
         raise ValueError("Formato file non supportato.")
 
 
-def segment_text_into_clauses(text: str) -> List[Clause]:
+# Questo pattern regex cerca righe che iniziano con:
+# - "Art." o "Articolo" seguito da un numero (es. Art. 1)
+# - "Clausola" seguita da un numero (es. Clausola 231)
+# - Numerazione a più livelli (es. 1., 1.1., 1.2.3.)
+# re.MULTILINE fa sì che ^ corrisponda all'inizio di ogni riga.
+# Il gruppo "kind" distingue articoli/clausole dalla numerazione, il gruppo
+# "num" cattura il numero (o il percorso numerico) senza prefissi.
+_CLAUSE_HEADING_PATTERN = re.compile(
+    r"^\s*(?P<title>(?P<kind>Art(?:icolo)?|Clausola)\.?\s*(?P<art_num>\d+)"
+    r"|(?P<num>\d+(?:\.\d+)*)\.)\s+",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+@dataclass(eq=False, slots=True)
+class ClauseNode:
     """
-    Suddivide un testo lungo in una lista di clausole, usando regex
-    per identificare gli inizi delle clausole (es. "Art. 1", "1.2.3").
+    Record leggero di una clausola: conserva solo gli offset nel testo
+    sorgente, il testo viene estratto solo quando serve.
     """
-    # Questo pattern regex cerca righe che iniziano con:
-    # - "Art." o "Articolo" seguito da un numero (es. Art. 1)
-    # - "Clausola" seguita da un numero (es. Clausola 231)
-    # - Numerazione a più livelli (es. 1., 1.1., 1.2.3.)
-    # re.MULTILINE fa sì che ^ corrisponda all'inizio di ogni riga.
-    pattern = re.compile(
-        r"^\s*(Art(?:icolo)?\.?\s*\d+|Clausola\s*\d+|\d+(?:\.\d+)*\.)\s+",
-        re.IGNORECASE | re.MULTILINE,
-    )
 
-    clauses = []
+    clause_id: str  # ID univoco e stabile (es. "art. 3", "art. 3/1.", "2.1.#2")
+    title: str  # Intestazione così come compare nel documento
+    level: int  # 0 per le radici, cresce con la profondità
+    start: int  # Inizio dell'intestazione
+    body_start: int  # Inizio del corpo (dopo l'intestazione)
+    end: int  # Fine del corpo (inizio dell'intestazione successiva)
+    source: str = field(repr=False)
+    parent_id: Optional[str] = None
+    children: List["ClauseNode"] = field(default_factory=list, repr=False)
+    path: Tuple[int, ...] = ()
+    is_article: bool = False
+
+    @property
+    def text(self) -> str:
+        """Corpo della clausola (esclusi i sotto-clausole)."""
+        return self.source[self.body_start : self.end].strip()
+
+
+@dataclass(slots=True)
+class ClauseTree:
+    """Albero articoli / sotto-clausole di un documento."""
+
+    source: str
+    nodes: List[ClauseNode]  # Tutte le clausole in ordine di documento
+    roots: List[ClauseNode]
+    by_id: Dict[str, ClauseNode] = field(default_factory=dict, repr=False)
+
+    def get(self, clause_id: str) -> Optional[ClauseNode]:
+        return self.by_id.get(clause_id)
+
+
+def _normalize_heading(match: "re.Match[str]") -> Tuple[str, Tuple[int, ...], bool]:
+    """
+    Restituisce etichetta normalizzata, percorso numerico e tipo di
+    un'intestazione, così che "Articolo 3" e "Art.3" coincidano.
+    """
+    if match.group("kind"):
+        number = int(match.group("art_num"))
+        prefix = "clausola" if match.group("kind").lower() == "clausola" else "art."
+        return f"{prefix} {number}", (number,), True
+    path = tuple(int(part) for part in match.group("num").split("."))
+    return match.group("num") + ".", path, False
+
+
+def _is_proper_prefix(prefix: Tuple[int, ...], path: Tuple[int, ...]) -> bool:
+    return len(prefix) < len(path) and path[: len(prefix)] == prefix
+
+
+def build_clause_tree(text: str) -> ClauseTree:
+    """
+    Segmenta il testo in un'unica passata (finditer) e costruisce l'albero
+    di articoli e sotto-clausole, in tempo lineare rispetto al testo.
+
+    Regole di annidamento:
+    - "Art. N" / "Clausola N" sono sempre radici;
+    - una numerazione "1.2." è figlia della numerazione aperta più vicina
+      che ne è prefisso (es. "1."), altrimenti dell'articolo corrente.
+    Le numerazioni relative a un articolo (es. i commi "1." sotto "Art. 3")
+    ricevono un ID qualificato ("art. 3/1."); eventuali duplicati residui
+    vengono disambiguati con un suffisso "#n".
+    """
+    nodes: List[ClauseNode] = []
+    roots: List[ClauseNode] = []
+    stack: List[ClauseNode] = []
+    seen_ids: Dict[str, int] = {}
+
+    for match in _CLAUSE_HEADING_PATTERN.finditer(text):
+        # Chiude la clausola precedente all'inizio dell'intestazione corrente
+        if nodes:
+            nodes[-1].end = match.start()
+
+        label, path, is_article = _normalize_heading(match)
 
-    # Troviamo tutti i titoli delle clausole che matchano il pattern
-    titles = pattern.findall(text)
-    # Usiamo il pattern per splittare il testo. Il risultato saranno i corpi delle clausole.
-    bodies = pattern.split(text)[
-        1:
-    ]  # Ignoriamo il primo elemento che è il testo prima della prima clausola
+        if is_article:
+            stack.clear()
+        else:
+            while (
+                stack
+                and not stack[-1].is_article
+                and not _is_proper_prefix(stack[-1].path, path)
+            ):
+                stack.pop()
+        parent = stack[-1] if stack else None
+
+        clause_id = label
+        article = stack[0] if stack and stack[0].is_article else None
+        if article is not None and not is_article:
+            # Numerazione assoluta (es. "3.1." sotto "Art. 3"): ID invariato,
+            # purché il padre non sia già una sotto-clausola qualificata
+            qualified_prefix = f"{article.clause_id}/"
+            absolute = (
+                len(path) > 1
+                and path[0] == article.path[0]
+                and not parent.clause_id.startswith(qualified_prefix)
+            )
+            if not absolute:
+                clause_id = qualified_prefix + label
+        occurrences = seen_ids.get(clause_id, 0) + 1
+        seen_ids[clause_id] = occurrences
+        if occurrences > 1:
+            clause_id = f"{clause_id}#{occurrences}"
 
-    if not titles:
+        node = ClauseNode(
+            clause_id=clause_id,
+            title=match.group("title").strip(),
+            level=len(stack),
+            start=match.start(),
+            body_start=match.end(),
+            end=len(text),
+            source=text,
+            parent_id=parent.clause_id if parent is not None else None,
+            path=path,
+            is_article=is_article,
+        )
+        if parent is not None:
+            parent.children.append(node)
+        else:
+            roots.append(node)
+        nodes.append(node)
+        stack.append(node)
+
+    if not nodes:
         # Se nessuna clausola è stata trovata, consideriamo l'intero documento come un'unica clausola
-        return [Clause(clause_id="documento_intero", text=text.strip())]
+        node = ClauseNode(
+            clause_id="documento_intero",
+            title="",
+            level=0,
+            start=0,
+            body_start=0,
+            end=len(text),
+            source=text,
+        )
+        return ClauseTree(
+            source=text, nodes=[node], roots=[node], by_id={node.clause_id: node}
+        )
+
+    return ClauseTree(
+        source=text,
+        nodes=nodes,
+        roots=roots,
+        by_id={node.clause_id: node for node in nodes},
+    )
+
+
+def build_clause_tree_from_pages(pages: Iterable[str]) -> ClauseTree:
+    """
+    Come build_clause_tree, ma a partire da uno stream di pagine (vedi
+    iter_document_pages). Gli offset si riferiscono al testo delle pagine
+    unite da "\\n".
+    """
+    return build_clause_tree("\n".join(pages))
 
-    for i, title in enumerate(titles):
-        clause_id = title.strip()
-        clause_text = bodies[i].strip() if i < len(bodies) else ""
-        clauses.append(Clause(clause_id=clause_id, text=clause_text))
 
-    return clauses
+# Limita le chiamate di embedding in parallelo (eseguite in thread separati)
+_embedding_semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+
+
+async def _find_precedents(text: str, deadline: Optional[float]) -> List[dict]:
+    """
+    Cerca i precedenti storici senza bloccare l'event loop. Se la deadline
+    scade durante la ricerca restituisce una lista vuota: l'analisi LLM
+    successiva risulterà comunque "PENDING".
+    """
+
+    async def _search() -> List[dict]:
+        async with _embedding_semaphore:
+            return await asyncio.to_thread(vector_store.find_similar_clauses, text)
+
+    if deadline is None:
+        return await _search()
+    remaining = deadline - asyncio.get_running_loop().time()
+    if remaining <= 0:
+        return []
+    try:
+        return await asyncio.wait_for(_search(), timeout=remaining)
+    except asyncio.TimeoutError:
+        return []
+
+
+async def _analyze_clause(
+    analysis: dict, deadline: Optional[float], queue: str
+) -> Dict[str, Any]:
+    analysis["historical_precedents"] = await _find_precedents(
+        analysis["company_text"], deadline
+    )
+    return await llm_service.generate_clause_analysis(analysis, deadline, queue)
 
 
 # Modifica la funzione compare_clauses per renderla asincrona
 async def compare_clauses(
-    company_clauses: List[Clause], standard_clauses: List[Clause]
+    company_clauses: Sequence[ClauseNode],
+    standard_clauses: Sequence[ClauseNode],
+    deadline: Optional[float] = None,
+    queue: str = "default",
 ) -> List[dict]:
+    """
+    Confronta le clausole e lancia le analisi LLM in parallelo.
+    `deadline` (loop.time() assoluto) limita la durata complessiva, ricerca
+    dei precedenti inclusa: le clausole non analizzate in tempo risultano con
+    raccomandazione "PENDING".
+    `queue` identifica l'analisi nello scheduler LLM (fair queueing).
+    """
     standard_map = {c.clause_id.lower().strip(): c.text for c in standard_clauses}
     company_map = {c.clause_id.lower().strip(): c.text for c in company_clauses}
+    parent_map = {
+        c.clause_id.lower().strip(): c.parent_id
+        for clauses in (standard_clauses, company_clauses)
+        for c in clauses
+        if c.parent_id
+    }
     all_ids = sorted(list(set(standard_map.keys()) | set(company_map.keys())))
 
     final_results = []
@@ -91,7 +282,12 @@ async def compare_clauses(
         standard_text = standard_map.get(clause_id)
         company_text = company_map.get(clause_id)
 
-        analysis = {"clause_id": clause_id.upper(), "historical_precedents": []}
+        parent_id = parent_map.get(clause_id)
+        analysis = {
+            "clause_id": clause_id.upper(),
+            "parent_id": parent_id.upper() if parent_id else None,
+            "historical_precedents": [],
+        }
         # ... (riempi analysis con status, testi, e precedenti come nello Step 4) ...
 
         # Identifica lo stato della clausola (unchanged, modified, new, deleted)
@@ -112,10 +308,8 @@ async def compare_clauses(
         analysis["standard_text"] = standard_text
 
         # Se la clausola è modificata o nuova, la prepariamo per l'LLM
+        # (i precedenti vengono cercati in _analyze_clause, fuori dall'event loop)
         if status in ["modified", "new"]:
-            analysis["historical_precedents"] = vector_store.find_similar_clauses(
-                company_text
-            )
             tasks_for_llm.append(
                 analysis
             )  # Aggiungi l'intera analisi alla lista dei task
@@ -124,10 +318,10 @@ async def compare_clauses(
                 analysis
             )  # Le clausole non modificate vanno direttamente nei risultati
 
-    # Esegui le analisi LLM in parallelo per la massima efficienza
+    # Esegui ricerca dei precedenti e analisi LLM in parallelo, entro la deadline
     if tasks_for_llm:
         llm_analyses = await asyncio.gather(
-            *(llm_service.generate_clause_analysis(task) for task in tasks_for_llm)
+            *(_analyze_clause(task, deadline, queue) for task in tasks_for_llm)
         )
         # Unisci i risultati dell'LLM con i dati delle clausole
         for i, task_data in enumerate(tasks_for_llm):
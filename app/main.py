@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from app.api import routes
 from app.config import HUGGINGFACE_API_KEY
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 app = FastAPI(
     title="CDP Financial Analysis API",
@@ -22,7 +23,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Analysis-Id"],  # ID della coda LLM (vedi /llm/stats)
 )
+# Compressione gzip delle risposte (le analisi complete arrivano a diversi MB)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 
 # Includiamo le rotte definite nel nostro modulo `routes`
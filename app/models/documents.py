@@ -20,6 +20,7 @@ class HistoricalPrecedent(BaseModel):
 
 class AnalyzedClause(BaseModel):
     clause_id: str
+    parent_id: Optional[str] = None
     status: Literal["unchanged", "modified", "new", "deleted"]
     company_text: Optional[str] = None
     standard_text: Optional[str] = None
@@ -27,6 +28,16 @@ class AnalyzedClause(BaseModel):
     llm_analysis: Optional[Dict[str, Any]] = None  # <-- AGGIUNGI QUESTO CAMPO
 
 
+class ClauseSummary(BaseModel):
+    """Vista ridotta di una clausola analizzata (/analyze con view=summary)."""
+
+    clause_id: str
+    parent_id: Optional[str] = None
+    status: Literal["unchanged", "modified", "new", "deleted"]
+    recommendation: Optional[str] = None
+    historical_precedent_ids: List[str] = []
+
+
 class DocumentAnalysisRequest(BaseModel):
     """Richiesta di analisi di un documento."""
 
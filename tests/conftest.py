@@ -0,0 +1,4 @@
+import os
+
+# app.config richiede la chiave all'import
+os.environ.setdefault("HUGGINGFACE_API_KEY", "test")
@@ -0,0 +1,139 @@
+import asyncio
+
+from app.core.llm_service import PRIORITY_INTERACTIVE, LLMScheduler
+
+
+def _assert_idle(scheduler):
+    stats = scheduler.get_stats()
+    assert stats["running"] == 0
+    assert stats["queue_depths"] == {}
+    assert stats["queued_bulk"] == stats["queued_interactive"] == 0
+    assert scheduler.has_capacity()
+    assert scheduler._last_finish == {}
+
+
+def test_global_limit_is_never_exceeded():
+    scheduler = LLMScheduler(3)
+    active = []
+    peak = []
+
+    async def job(queue):
+        async with scheduler.slot(queue):
+            active.append(queue)
+            peak.append(len(active))
+            await asyncio.sleep(0.01)
+            active.remove(queue)
+
+    async def run():
+        await asyncio.gather(*(job(f"q{i % 4}") for i in range(40)))
+
+    asyncio.run(run())
+    assert max(peak) == 3
+    assert scheduler.get_stats()["completed"] == 40
+    assert scheduler.get_stats()["running"] == 0
+
+
+def test_chat_is_served_before_queued_bulk_work():
+    scheduler = LLMScheduler(1)
+    order = []
+
+    async def job(queue, priority=1):
+        async with scheduler.slot(queue, priority=priority):
+            order.append(queue)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        tasks = [asyncio.create_task(job("bulk")) for _ in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("chat", PRIORITY_INTERACTIVE)))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    # Il primo job bulk ha già lo slot, la chat passa subito dopo
+    assert order[:2] == ["bulk", "chat"]
+
+
+def test_small_queue_interleaves_with_large_one():
+    scheduler = LLMScheduler(2)
+    order = []
+
+    async def job(queue):
+        async with scheduler.slot(queue):
+            order.append(queue)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        tasks = [asyncio.create_task(job("big")) for _ in range(20)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(job("small")) for _ in range(3)]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    small_positions = [i for i, queue in enumerate(order) if queue == "small"]
+    assert len(small_positions) == 3
+    # Le 3 richieste small terminano ben prima del grosso della coda big
+    assert small_positions[-1] < 10
+    _assert_idle(scheduler)
+
+
+def test_cancelled_while_queued_leaves_scheduler_consistent():
+    scheduler = LLMScheduler(1)
+
+    async def hold(release):
+        async with scheduler.slot("big"):
+            await release.wait()
+
+    async def waiter():
+        async with scheduler.slot("small"):
+            pass
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(release))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()["queue_depths"] == {"small": 1}
+
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert scheduler.get_stats()["queue_depths"] == {}
+        assert scheduler.get_stats()["running"] == 1
+
+        release.set()
+        await holder
+
+    asyncio.run(run())
+    _assert_idle(scheduler)
+
+
+def test_cancelled_after_slot_granted_hands_slot_on():
+    scheduler = LLMScheduler(1)
+    served = []
+    tasks = {}
+
+    async def hold(release):
+        async with scheduler.slot("a"):
+            await release.wait()
+        # Il rilascio ha appena risolto il future di "b": lo annulliamo
+        # prima che possa usare lo slot, che deve passare a "c".
+        tasks["b"].cancel()
+
+    async def waiter(name):
+        async with scheduler.slot(name):
+            served.append(name)
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(release))
+        await asyncio.sleep(0)
+        tasks["b"] = asyncio.create_task(waiter("b"))
+        tasks["c"] = asyncio.create_task(waiter("c"))
+        await asyncio.sleep(0)
+
+        release.set()
+        await asyncio.gather(holder, *tasks.values(), return_exceptions=True)
+
+    asyncio.run(run())
+    assert served == ["c"]
+    _assert_idle(scheduler)
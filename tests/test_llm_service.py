@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from app.core import llm_service
+from app.core.llm_service import LLMScheduler
+
+OK_RESPONSE = {"choices": [{"message": {"content": '{"recommendation": "ACCEPT"}'}}]}
+CLAUSE = {"status": "modified", "company_text": "testo", "clause_id": "ART. 1"}
+
+
+@pytest.fixture(autouse=True)
+def _isolated_state(monkeypatch):
+    monkeypatch.setattr(llm_service, "scheduler", LLMScheduler(8))
+    monkeypatch.setattr(llm_service, "_latencies", {})
+
+
+def _fake_openrouter(monkeypatch, durations, calls, fail_first=False):
+    """Sostituisce _call_openrouter: la chiamata i-esima dura durations[i]."""
+
+    async def fake(messages, model=llm_service.OPENROUTER_MODEL, timeout=60.0):
+        index = len(calls)
+        calls.append(model)
+        if fail_first and index == 0:
+            raise RuntimeError("upstream error")
+        await asyncio.sleep(durations[min(index, len(durations) - 1)])
+        return OK_RESPONSE
+
+    monkeypatch.setattr(llm_service, "_call_openrouter", fake)
+
+
+def test_slow_call_is_hedged_and_first_answer_wins(monkeypatch):
+    calls = []
+    _fake_openrouter(monkeypatch, [10.0, 0.01], calls)
+    monkeypatch.setattr(llm_service, "HEDGE_DEFAULT_DELAY", 0.05)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await llm_service._call_with_deadline([], loop.time() + 5, "q")
+        return result, loop.time() - started
+
+    result, elapsed = asyncio.run(run())
+    assert result == OK_RESPONSE
+    assert len(calls) == 2
+    assert elapsed < 1
+
+
+def test_deadline_cancels_running_call_and_returns_pending(monkeypatch):
+    cancelled = []
+
+    async def fake(messages, model=llm_service.OPENROUTER_MODEL, timeout=60.0):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return OK_RESPONSE
+
+    monkeypatch.setattr(llm_service, "_call_openrouter", fake)
+    monkeypatch.setattr(llm_service, "HEDGE_DEFAULT_DELAY", 10.0)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        result = await llm_service.generate_clause_analysis(
+            dict(CLAUSE), loop.time() + 0.1, "q"
+        )
+        await asyncio.sleep(0)  # lascia completare la cancellazione
+        return result
+
+    result = asyncio.run(run())
+    assert result["recommendation"] == "PENDING"
+    assert cancelled == [llm_service.OPENROUTER_MODEL]
+    assert llm_service.scheduler.get_stats()["running"] == 0
+
+
+def test_pick_model_falls_back_when_budget_below_p95(monkeypatch):
+    assert llm_service._pick_model(0.1) == llm_service.OPENROUTER_MODEL
+
+    for _ in range(llm_service.HEDGE_MIN_SAMPLES):
+        llm_service._record_latency(llm_service.OPENROUTER_MODEL, 2.0)
+
+    assert llm_service._pick_model(1.0) == llm_service.OPENROUTER_FALLBACK_MODEL
+    assert llm_service._pick_model(5.0) == llm_service.OPENROUTER_MODEL
+
+
+def test_failed_first_call_is_retried_once(monkeypatch):
+    calls = []
+    _fake_openrouter(monkeypatch, [0.01], calls, fail_first=True)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        return await llm_service._call_with_deadline([], loop.time() + 5, "q")
+
+    assert asyncio.run(run()) == OK_RESPONSE
+    assert len(calls) == 2
+
+
+def test_queue_wait_alone_does_not_trigger_hedge(monkeypatch):
+    # Ogni chiamata dura meno del ritardo di hedge, ma molte restano in
+    # coda più a lungo: non deve partire nessuna richiesta duplicata.
+    calls = []
+    _fake_openrouter(monkeypatch, [0.05], calls)
+    monkeypatch.setattr(llm_service, "HEDGE_DEFAULT_DELAY", 0.08)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 10
+        return await asyncio.gather(
+            *(llm_service._call_with_deadline([], deadline, "q") for _ in range(60))
+        )
+
+    results = asyncio.run(run())
+    assert results == [OK_RESPONSE] * 60
+    assert len(calls) == 60
@@ -0,0 +1,61 @@
+from app.core.processor import build_clause_tree, build_clause_tree_from_pages
+
+
+def _ids(text):
+    return [(node.clause_id, node.parent_id) for node in build_clause_tree(text).nodes]
+
+
+def test_restarted_numbering_under_articles_is_qualified():
+    text = (
+        "Art. 1 Oggetto\n1. uno\n2. due\n"
+        "Art. 2 Durata\n1. uno\n2. due\n3. tre\n"
+        "Art. 3 Recesso\n1. uno\n"
+    )
+    assert _ids(text) == [
+        ("art. 1", None),
+        ("art. 1/1.", "art. 1"),
+        ("art. 1/2.", "art. 1"),
+        ("art. 2", None),
+        ("art. 2/1.", "art. 2"),
+        ("art. 2/2.", "art. 2"),
+        ("art. 2/3.", "art. 2"),
+        ("art. 3", None),
+        ("art. 3/1.", "art. 3"),
+    ]
+
+
+def test_absolute_numbering_under_article_keeps_its_id():
+    text = "Articolo 3 Durata\n3.1. primo\n3.1.1. dettaglio\n2. comma\n2.1. sub\n"
+    assert _ids(text) == [
+        ("art. 3", None),
+        ("3.1.", "art. 3"),
+        ("3.1.1.", "3.1."),
+        ("art. 3/2.", "art. 3"),
+        ("art. 3/2.1.", "art. 3/2."),
+    ]
+
+
+def test_numbering_without_articles_and_duplicates():
+    tree = build_clause_tree("1. uno\n1.1. sub\n2. due\n1. ancora\n")
+    assert [n.clause_id for n in tree.nodes] == ["1.", "1.1.", "2.", "1.#2"]
+    assert tree.get("1.1.").parent_id == "1."
+    assert tree.get("1.1.").text == "sub"
+    assert [n.clause_id for n in tree.roots] == ["1.", "2.", "1.#2"]
+
+
+def test_no_headings_returns_whole_document():
+    tree = build_clause_tree("Testo senza clausole.")
+    assert [n.clause_id for n in tree.nodes] == ["documento_intero"]
+    assert tree.nodes[0].text == "Testo senza clausole."
+
+
+def test_pages_match_joined_text():
+    pages = ["Art. 1 Oggetto\n1. uno", "2. due\nArt. 2 Durata"]
+    tree = build_clause_tree_from_pages(pages)
+    assert tree.source == "\n".join(pages)
+    assert [n.clause_id for n in tree.nodes] == [
+        "art. 1",
+        "art. 1/1.",
+        "art. 1/2.",
+        "art. 2",
+    ]
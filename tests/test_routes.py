@@ -0,0 +1,91 @@
+import copy
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.routes import _parse_fields, _project_results
+
+
+def _precedent(historical_id):
+    return {
+        "historical_id": historical_id,
+        "text": "precedente",
+        "metadata": {"status": "approved"},
+        "similarity_score": 0.9,
+    }
+
+
+RESULTS = [
+    {
+        "clause_id": "ART. 1",
+        "parent_id": None,
+        "status": "modified",
+        "company_text": "testo azienda",
+        "standard_text": "testo standard",
+        "historical_precedents": [_precedent("h1"), _precedent("h2")],
+        "llm_analysis": {"recommendation": "ACCEPT", "summary": "ok"},
+    },
+    {
+        "clause_id": "ART. 1/1.",
+        "parent_id": "ART. 1",
+        "status": "unchanged",
+        "company_text": "uguale",
+        "standard_text": "uguale",
+        "historical_precedents": [],
+    },
+]
+
+
+def test_full_view_without_fields_is_unchanged():
+    results = copy.deepcopy(RESULTS)
+    assert _project_results(results, "full", _parse_fields("full", None)) == RESULTS
+
+
+def test_summary_view():
+    summary = _project_results(RESULTS, "summary", None)
+    assert summary == [
+        {
+            "clause_id": "ART. 1",
+            "parent_id": None,
+            "status": "modified",
+            "recommendation": "ACCEPT",
+            "historical_precedent_ids": ["h1", "h2"],
+        },
+        {
+            "clause_id": "ART. 1/1.",
+            "parent_id": "ART. 1",
+            "status": "unchanged",
+            "recommendation": None,
+            "historical_precedent_ids": [],
+        },
+    ]
+
+
+def test_fields_filter_full_view():
+    selected = _parse_fields("full", "clause_id, status")
+    assert _project_results(RESULTS, "full", selected) == [
+        {"clause_id": "ART. 1", "status": "modified"},
+        {"clause_id": "ART. 1/1.", "status": "unchanged"},
+    ]
+
+
+def test_fields_filter_summary_view():
+    selected = _parse_fields("summary", "clause_id,historical_precedent_ids")
+    assert _project_results(RESULTS, "summary", selected) == [
+        {"clause_id": "ART. 1", "historical_precedent_ids": ["h1", "h2"]},
+        {"clause_id": "ART. 1/1.", "historical_precedent_ids": []},
+    ]
+
+
+@pytest.mark.parametrize(
+    "view, fields",
+    [
+        ("full", "clause_id,foo"),
+        ("full", "recommendation"),  # esiste solo nella vista summary
+        ("summary", "company_text"),  # esiste solo nella vista full
+    ],
+)
+def test_unknown_fields_are_rejected(view, fields):
+    with pytest.raises(HTTPException) as exc_info:
+        _parse_fields(view, fields)
+    assert exc_info.value.status_code == 400